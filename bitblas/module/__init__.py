@@ -1,8 +1,12 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 import ctypes
-import operator
-from functools import reduce
+import os
+import threading
+import time
+import warnings
+import weakref
+from functools import lru_cache
 from logging import getLogger
 
 import torch
@@ -20,61 +24,205 @@ from bitblas import Matmul, MatmulConfig
 from bitblas.quantization.utils import general_compress
 from bitblas import auto_detect_nvidia_target
 from bitblas.base.operator_common import OptimizeStrategy
+from bitblas.ops.operator import OPExecutorCPU
 
 BITBLAS_DATABASE_PATH = get_database_path()
+BITBLAS_DEV_BENCHMARK_UNPACK = (
+    os.environ.get("BITBLAS_DEV_BENCHMARK_UNPACK", "0") == "1"
+)
+# operator_cache -> (database_path, target) combinations already loaded into it;
+# weak keys so a collected cache never shadows a new one at the same address.
+_LOADED_OPERATOR_CACHES = weakref.WeakKeyDictionary()
 
 
-def unpack_qzeros(qzeros, bits):
-    qzeros = qzeros.view(torch.int32)
-    elems_per_int32 = 32 // bits
-    unpacked_zeros = torch.zeros(
-        (qzeros.shape[0], qzeros.shape[1] * elems_per_int32),
-        dtype=torch.int8,
-        device=qzeros.device,
-        requires_grad=False,
-    )
-    for col in range(unpacked_zeros.shape[1]):
-        i = col % elems_per_int32
-        unpacked_zeros[:, col] = qzeros[:, col // elems_per_int32] >> (bits * i)
+def _current_gpu_id():
+    return torch.cuda.current_device() if torch.cuda.is_available() else 0
+
+
+def _physical_gpu_id(gpu_id):
+    # nvidia-smi numbers every gpu on the host and ignores CUDA_VISIBLE_DEVICES,
+    # so map the logical torch index back when the variable lists indices.
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",")
+    if 0 <= gpu_id < len(visible) and visible[gpu_id].strip().isdigit():
+        return int(visible[gpu_id])
+    return gpu_id
+
+
+@lru_cache(maxsize=None)
+def _cached_target(gpu_id):
+    # target detection queries nvidia-smi, do it once per gpu instead of per layer.
+    return auto_detect_nvidia_target(_physical_gpu_id(gpu_id))
+
+
+def refresh_target(gpu_id: Optional[int] = None):
+    """
+    Drop the memoized targets and detect the target of `gpu_id` (the current
+    CUDA device by default) again. Targets are memoized per gpu, so Linear picks
+    the right one on hosts that mix GPU models; refresh only when the hardware
+    behind an index changes, e.g. after changing CUDA_VISIBLE_DEVICES.
+    """
+    if gpu_id is None:
+        gpu_id = _current_gpu_id()
+    _cached_target.cache_clear()
+    return _cached_target(gpu_id)
+
+
+def _unpack_shifts(bits, device):
+    # right shift of every `bits`-wide field of an int32 word, low bits first.
+    return torch.arange(32 // bits, dtype=torch.int32, device=device) * bits
+
+
+def _unpack_bits(packed, bits, shifts=None):
+    # Broadcast one right shift per packed field instead of looping over the
+    # output columns, so the whole unpack is a single elementwise kernel.
+    elems_per_pack = packed.element_size() * 8 // bits
+    if shifts is None:
+        shifts = _unpack_shifts(bits, packed.device)
+    unpacked = (packed.unsqueeze(-1) >> shifts[:elems_per_pack]).to(torch.int8)
+    return unpacked.reshape(packed.shape[0], -1)
+
+
+def unpack_qzeros(qzeros, bits, mask=None, shifts=None):
+    if mask is None:
+        mask = 2**bits - 1
+    unpacked_zeros = _unpack_bits(qzeros.view(torch.int32), bits, shifts)
 
     # Follow the instruction in AutoGPTQ qlinear_cuda_old.py line 303
     # NOTE: It appears that casting after the `unpacked_zeros  + 1` is important.
-    return torch.bitwise_and(unpacked_zeros + 1, 2**bits - 1)
+    return torch.bitwise_and(unpacked_zeros + 1, mask)
 
 
 # For gptqv2 from gptqmodel
-def unpack_qzeros_v2(qzeros, bits):
-    qzeros = qzeros.view(torch.int32)
-    elems_per_int32 = 32 // bits
-    unpacked_zeros = torch.zeros(
-        (qzeros.shape[0], qzeros.shape[1] * elems_per_int32),
-        dtype=torch.int8,
-        device=qzeros.device,
-        requires_grad=False,
+def unpack_qzeros_v2(qzeros, bits, mask=None, shifts=None):
+    if mask is None:
+        mask = 2**bits - 1
+    unpacked_zeros = _unpack_bits(qzeros.view(torch.int32), bits, shifts)
+    return torch.bitwise_and(unpacked_zeros, mask)
+
+
+def unpack_qweight(qweight, bits, mask=None, shifts=None):
+    if mask is None:
+        mask = 2**bits - 1
+    qweight = qweight.view(torch.int8)
+    if (
+        8 % bits == 0
+        and qweight.shape[-1] % 4 == 0
+        and qweight.stride(-1) == 1
+        and qweight.storage_offset() % 4 == 0
+        and all(stride % 4 == 0 for stride in qweight.stride()[:-1])
+    ):
+        # Fields never straddle a byte, so unpacking whole int32 words yields the
+        # same little-endian field order with a quarter of the loads. Views that
+        # cannot be reinterpreted as int32 (row strides or offset not a multiple
+        # of 4) stay on the byte path.
+        qweight = qweight.view(torch.int32)
+    unpacked_weight = _unpack_bits(qweight, bits, shifts)
+    return torch.bitwise_and(unpacked_weight, mask)
+
+
+def _dev_benchmark_unpack(
+    qweight, qzeros, bits, unpack_qzeros_fn, unpack_weight=True, repeats=10
+):
+    # Developer hook, enabled with BITBLAS_DEV_BENCHMARK_UNPACK=1: time the
+    # gptq unpack kernels on the tensors being repacked.
+    def bench(fn, *args):
+        fn(*args)
+        if qweight.is_cuda:
+            torch.cuda.synchronize()
+        tic = time.perf_counter()
+        for _ in range(repeats):
+            fn(*args)
+        if qweight.is_cuda:
+            torch.cuda.synchronize()
+        return (time.perf_counter() - tic) * 1000 / repeats
+
+    qweight = qweight.T.contiguous()
+    if unpack_weight:
+        qweight_time = f"{bench(unpack_qweight, qweight, bits):.3f} ms"
+    else:
+        # the layer repacks the packed bytes directly and never unpacks qweight.
+        qweight_time = "skipped (packed fast path)"
+    print(
+        f"unpack_qweight {tuple(qweight.shape)}: {qweight_time}, "
+        f"{unpack_qzeros_fn.__name__} {tuple(qzeros.shape)}: "
+        f"{bench(unpack_qzeros_fn, qzeros, bits):.3f} ms"
     )
-    for col in range(unpacked_zeros.shape[1]):
-        i = col % elems_per_int32
-        unpacked_zeros[:, col] = qzeros[:, col // elems_per_int32] >> (bits * i)
 
-    # Follow the instruction in AutoGPTQ qlinear_cuda_old.py line 303
-    # NOTE: It appears that casting after the `unpacked_zeros  + 1` is important.
-    return torch.bitwise_and(unpacked_zeros, 2**bits - 1)
 
+def _pack_low_bits(x, bits, storage_dtype=torch.int8):
+    # On-device equivalent of general_compress: pack every `storage_nbit // bits`
+    # consecutive fields of the last dim into one storage element, low bits first.
+    storage_nbit = torch.iinfo(storage_dtype).bits
+    elems_per_storage = storage_nbit // bits
+    x = x.to(torch.int32).reshape(*x.shape[:-1], -1, elems_per_storage)
+    shifts = torch.arange(elems_per_storage, dtype=torch.int32, device=x.device) * bits
+    # The shifted fields occupy disjoint bits, so the sum is their bitwise or.
+    return (x << shifts).sum(dim=-1, dtype=torch.int32).to(storage_dtype)
 
-def unpack_qweight(qweight, bits):
-    qweight = qweight.view(torch.int8)
-    elems_per_int8 = 8 // bits
-    unpacked_weight = torch.zeros(
-        (qweight.shape[0], qweight.shape[1] * elems_per_int8),
-        dtype=torch.int8,
-        device=qweight.device,
-        requires_grad=False,
+
+def _compress_zeros(intzeros, bits, storage_dtype=torch.int8):
+    if intzeros.is_cuda:
+        return _pack_low_bits(intzeros, bits, storage_dtype)
+    # Host tensors take the NumPy path, which is numba-compiled when available.
+    return torch.from_numpy(general_compress(intzeros.contiguous().numpy(), bits))
+
+
+def _same_layout(a, b):
+    return (
+        isinstance(a, torch.Tensor)
+        and a.shape == b.shape
+        and a.dtype == b.dtype
+        and a.device == b.device
     )
-    for col in range(unpacked_weight.shape[1]):
-        i = col % elems_per_int8
-        unpacked_weight[:, col] = qweight[:, col // elems_per_int8] >> (bits * i)
 
-    return torch.bitwise_and(unpacked_weight, 2**bits - 1)
+
+def _finalize_zeros(intzeros, scales, zeros_mode, out):
+    # intzeros comes straight from unpack_qzeros as
+    # (in_features // group_size, out_features). Either branch is one kernel over
+    # the transposed view: mul promotes int8 to the scales dtype internally and
+    # copy_ casts while copying, so no transposed or cast copy is materialized.
+    if zeros_mode == "rescale":
+        return torch.mul(intzeros.T, scales, out=out)
+    return out.copy_(intzeros.T)
+
+
+def _dequantize_zeros(
+    qzeros, scales, bits, mask, shifts, zeros_mode, unpack_qzeros_fn, out
+):
+    intzeros = unpack_qzeros_fn(qzeros, bits, mask, shifts)
+    return _finalize_zeros(intzeros, scales, zeros_mode, out)
+
+
+@lru_cache(maxsize=1)
+def _get_compiled_dequantize_zeros():
+    # Built on first use rather than at import, which would pay for loading
+    # dynamo on every `import bitblas`. Shapes are static per layer.
+    return torch.compile(_dequantize_zeros, dynamic=False)
+
+
+_compile_dequantize_zeros_failed = False
+
+
+def _compiled_dequantize_zeros(*args):
+    # Fuses unpack, transpose, cast and rescale into one kernel writing `out`.
+    # inductor needs triton on CUDA, which is not a bitblas dependency, so fall
+    # back to the eager version for good once the backend fails to compile it.
+    global _compile_dequantize_zeros_failed
+    if not _compile_dequantize_zeros_failed:
+        compiled = _get_compiled_dequantize_zeros()
+        from torch._dynamo.exc import BackendCompilerFailed
+
+        try:
+            return compiled(*args)
+        except BackendCompilerFailed as e:
+            _compile_dequantize_zeros_failed = True
+            # a warning, since this module silences the bitblas logger.
+            warnings.warn(
+                f"torch.compile failed, dequantizing GPTQ zeros eagerly: {e}",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+    return _dequantize_zeros(*args)
 
 
 class Linear(nn.Module):
@@ -88,6 +236,7 @@ class Linear(nn.Module):
         torch.int8: "int8",
     }
     _tuning_message_shown = False
+    _tuning_lock = threading.Lock()
 
     def __init__(
         self,
@@ -118,14 +267,24 @@ class Linear(nn.Module):
         if the input shape is a range, we will optimize the matmul with dynamic symbolic.
         if the input shape is int, we will optimize the matmul with static symbolic.
 
+        @A_dtype: also the dtype of scales, non-quantized zeros and bias, as the
+        dequantize kernels read them in the activation dtype. "bfloat16" avoids a
+        conversion for bf16 models at the cost of fewer mantissa bits in the scales.
+
         @operator_cache: A specific cache instance to use for this linear layer
         @database_path: A specific database path to use for this linear layer
         @create_missing_path: If True, create the database path if it doesn't exist
         """
-        import os
-
         super().__init__()
 
+        self._param_ptrs = None
+        # (stream pointer, ctypes handle), swapped as one object so that
+        # concurrent forward() calls never pair a pointer with a stale handle.
+        self._stream = (None, None)
+        self._graph = None
+        self._static_A = None
+        self._static_out = None
+
         # Store the model-specific cache
         self.operator_cache = (
             operator_cache if operator_cache is not None else global_operator_cache
@@ -182,22 +341,25 @@ class Linear(nn.Module):
         )
         self._initialize_buffers(in_features, out_features, bias)
 
-    def init_params(self):
-        # eliminate runtime overhead like exllama state
+    def _param_list(self):
         if self.is_consitent:
             param_list = [self.weight]
-            if self.bitblas_matmul.config.with_bias:
-                param_list.append(self.bias)
-            self.q_params = [ctypes.c_void_p(arr.data_ptr()) for arr in param_list]
         else:
             param_list = [self.qweight]
             if self.bitblas_matmul.config.with_scaling:
                 param_list.append(self.scales)
             if self.bitblas_matmul.config.with_zeros:
                 param_list.append(self.zeros)
-            if self.bitblas_matmul.config.with_bias:
-                param_list.append(self.bias)
-            self.q_params = [ctypes.c_void_p(arr.data_ptr()) for arr in param_list]
+        if self.bitblas_matmul.config.with_bias:
+            param_list.append(self.bias)
+        return param_list
+
+    def init_params(self):
+        # eliminate runtime overhead like exllama state
+        param_ptrs = [arr.data_ptr() for arr in self._param_list()]
+        self.q_params = [ctypes.c_void_p(ptr) for ptr in param_ptrs]
+        # published last, so forward() never pairs them with stale q_params.
+        self._param_ptrs = param_ptrs
 
     def _validate_parameters(self, group_size, in_features, out_features):
         if in_features % 16 != 0 or out_features % 16 != 0:
@@ -299,13 +461,21 @@ class Linear(nn.Module):
             matmul_config, enable_tuning
         )
         self.bits = self.bitblas_matmul.bit
+        # unpacking constants for repack_from_gptq*, shifts are cached per device.
+        self._unpack_mask = (1 << self.bits) - 1
+        self._unpack_shifts_cache = {}
+        # transform_input is the identity unless the A operand is ladder permutated.
+        self._needs_input_transform = self.bitblas_matmul.input_transform is not None
         self.source_format = self.bitblas_matmul.source_format
 
     def _get_or_create_bitblas_operator(self, config, enable_tuning):
-        BITBLAS_TARGET = auto_detect_nvidia_target()
+        BITBLAS_TARGET = _cached_target(_current_gpu_id())
 
-        if self.operator_cache.size() == 0:
+        loaded = _LOADED_OPERATOR_CACHES.setdefault(self.operator_cache, set())
+        cache_key = (self.database_path, BITBLAS_TARGET)
+        if cache_key not in loaded and self.operator_cache.size() == 0:
             self.operator_cache.load_from_database(self.database_path, BITBLAS_TARGET)
+            loaded.add(cache_key)
             logger.info(f"Loaded {self.operator_cache.size()} operators from database.")
 
         bitblas_matmul = self.operator_cache.get(config)
@@ -314,10 +484,12 @@ class Linear(nn.Module):
             if enable_tuning:
                 # Only show the tuning message once
                 if not Linear._tuning_message_shown:
-                    print(
-                        "Compiling matmul kernels...this may take a few minutes. This is a one-time operation."
-                    )
-                    Linear._tuning_message_shown = True
+                    with Linear._tuning_lock:
+                        if not Linear._tuning_message_shown:
+                            print(
+                                "Compiling matmul kernels...this may take a few minutes. This is a one-time operation."
+                            )
+                            Linear._tuning_message_shown = True
 
                 bitblas_matmul.hardware_aware_finetune(topk=20)
                 self.operator_cache.add(config, bitblas_matmul)
@@ -335,27 +507,85 @@ class Linear(nn.Module):
         print("Warming up BitBLAS Matmul...")
         self.bitblas_matmul.hardware_aware_finetune(topk=topk)
 
+    def capture(self, A_example):
+        """
+        Capture forward() for inputs shaped like `A_example` into a CUDA graph.
+
+        Later forward() calls without an explicit `output` and with the same input
+        shape, dtype and device copy the input into a static buffer and replay the
+        graph. The returned tensor is the static output buffer, which is
+        overwritten by the next replay. Replacing the storage of a parameter
+        (reassigning it, moving it or swapping its `.data`) drops the captured graph.
+        """
+        if self._needs_input_transform:
+            raise ValueError("CUDA graph capture does not support input transforms.")
+        self._graph = None
+        static_A = A_example.clone()
+        static_out = torch.empty(
+            static_A.shape[:-1] + (self.out_features,),
+            dtype=getattr(torch, self.bitblas_matmul.out_dtype),
+            device=static_A.device,
+        )
+
+        # warm up on a side stream so that lazy initialization is not captured.
+        side_stream = torch.cuda.Stream(device=static_A.device)
+        side_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(side_stream):
+            self.forward(static_A, output=static_out)
+        torch.cuda.current_stream().wait_stream(side_stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            self.forward(static_A, output=static_out)
+
+        self._graph = graph
+        self._static_A = static_A
+        self._static_out = static_out
+        return static_out
+
     def forward(self, A, output=None):
-        A = self.bitblas_matmul.transform_input(A)
+        # reassigning, moving or swapping `.data` of a parameter all show up as a
+        # new storage address; the cached pointers, and any graph captured with
+        # them, are stale then.
+        if [arr.data_ptr() for arr in self._param_list()] != self._param_ptrs:
+            self._graph = None
+            self._static_A = None
+            self._static_out = None
+            self.init_params()
+
+        if (
+            self._graph is not None
+            and output is None
+            and A.shape == self._static_A.shape
+            and A.dtype == self._static_A.dtype
+            and A.device == self._static_A.device
+        ):
+            self._static_A.copy_(A)
+            self._graph.replay()
+            return self._static_out
+
+        if self._needs_input_transform:
+            A = self.bitblas_matmul.transform_input(A)
+        else:
+            A = A.contiguous()
         stream = torch.cuda.current_stream()
+        stream_ptr, stream_handle = self._stream
+        if stream.cuda_stream != stream_ptr:
+            stream_handle = ctypes.c_void_p(stream.cuda_stream)
+            self._stream = (stream.cuda_stream, stream_handle)
 
-        A_void = ctypes.c_void_p(A.data_ptr())
-        stream_handle = ctypes.c_void_p(stream.cuda_stream)
-        # can be lifted to post init.
-        self.init_params()
-        args = [A_void, *self.q_params]
+        args = [ctypes.c_void_p(A.data_ptr()), *self.q_params]
         if output is None:
-            output = torch.zeros(
+            output = torch.empty(
                 A.shape[:-1] + (self.out_features,),
                 dtype=getattr(torch, self.bitblas_matmul.out_dtype),
                 device=A.device,
             )
         args.append(ctypes.c_void_p(output.data_ptr()))
         if self.bitblas_matmul.dynamic_range is not None:
-            m = reduce(operator.mul, A.shape[:-1], 1)
-            args.append(m)
+            # m is the product of the last n - 1 dimensions of A
+            args.append(A.numel() // A.shape[-1])
         args.append(stream_handle)
-        # m is the product of the last n - 1 dimensions of A
         self.bitblas_matmul.lib.call(*args)
 
         return output
@@ -371,86 +601,235 @@ class Linear(nn.Module):
             assert scales is None, "scales should be None for consistent mode."
             assert zeros is None, "zeros should be None for consistent mode."
             weight = self.bitblas_matmul.transform_weight(weight)
-            self.weight = nn.Parameter(weight)
+            if isinstance(self.weight, nn.Parameter):
+                self._copy_or_assign("weight", weight)
+            else:
+                self.weight = nn.Parameter(weight)
             if bias is not None:
-                self.bias = bias
+                self._copy_or_assign("bias", bias)
         else:
             weight = self.bitblas_matmul.transform_weight(weight)
-            self.qweight = weight
+            self._copy_or_assign("qweight", weight)
             if scales is not None:
-                self.scales = scales
+                self._copy_or_assign("scales", scales)
             if zeros is not None:
-                self.zeros = zeros
+                self._copy_or_assign("zeros", zeros)
             if bias is not None:
-                self.bias = bias
+                self._copy_or_assign("bias", bias)
+
+    def _copy_or_assign(self, name, value):
+        # Copy into the existing tensor when it is compatible, which keeps its
+        # storage (and the cached kernel pointers) instead of allocating anew.
+        current = getattr(self, name, None)
+        if _same_layout(current, value):
+            with torch.no_grad():
+                current.copy_(value)
+        elif isinstance(current, nn.Parameter):
+            # a Parameter slot only accepts another Parameter.
+            setattr(
+                self, name, nn.Parameter(value, requires_grad=current.requires_grad)
+            )
+        else:
+            setattr(self, name, value)
+
+    def _get_unpack_shifts(self, device):
+        shifts = self._unpack_shifts_cache.get(device)
+        if shifts is None:
+            shifts = _unpack_shifts(self.bits, device)
+            self._unpack_shifts_cache[device] = shifts
+        return shifts
+
+    def _transform_weight(self, intweight, device, weight_transform=None):
+        # The weight executors are compiled for the host (llvm target), so they
+        # have to run on a CPU copy; stage the result in pinned memory so the
+        # upload is asynchronous.
+        if weight_transform is None:
+            weight_transform = self.bitblas_matmul.weight_transform
+        qweight = weight_transform(intweight.cpu())
+        if torch.device(device).type == "cuda":
+            qweight = qweight.pin_memory()
+        return qweight.to(device, non_blocking=True)
+
+    def _needs_unpacked_weight(self):
+        weight_transform = self.bitblas_matmul.weight_transform
+        return (
+            weight_transform is not None
+            and weight_transform.operators[0] is not self.bitblas_matmul.weight_compress
+        )
+
+    def _repack_qweight(self, qweight, device):
+        # qweight is the transposed gptq qweight viewed as storage dtype.
+        weight_transform = self.bitblas_matmul.weight_transform
+        if weight_transform is None:
+            return qweight
+        if not self._needs_unpacked_weight():
+            # gptq packs the fields low bits first along in_features, which is
+            # exactly the QuantCompress layout, so skip unpack + compress and only
+            # apply the remaining (LOP3) permutation to the packed weight.
+            operators = weight_transform.operators
+            if len(operators) == 1:
+                return qweight.to(device)
+            return self._transform_weight(qweight, device, OPExecutorCPU(operators[1:]))
+        intweight = unpack_qweight(
+            qweight,
+            self.bits,
+            self._unpack_mask,
+            self._get_unpack_shifts(qweight.device),
+        )
+        return self._transform_weight(intweight.contiguous(), device)
 
     def repack_from_gptq(self, gptq_module, device="cuda"):
-        # qweight in gptq old quant linear stored with (out_features, in_features), should be transposed.
-        qweight = gptq_module.qweight.T.contiguous().view(self.TORCH_STORAGE_DTYPE)
-        intweight = unpack_qweight(qweight, self.bits).contiguous()
-        if self.bitblas_matmul.weight_transform is not None:
-            qweight = self.bitblas_matmul.weight_transform(intweight.cpu()).to(device)
-        self.qweight = qweight
-        # scales in gptq old quant linear stored with (in_features // group_size, out_features), should be transposed.
-        scales = gptq_module.scales.T.contiguous().view(self.torch_dtype)
-        self.scales = scales
-        # qzeros should be dequantized to int zeros.
-        intzeros = unpack_qzeros(gptq_module.qzeros, self.bits).T.contiguous()
-        if self.bitblas_matmul.config.zeros_mode == "original":
-            self.zeros = intzeros.to(torch.float16).contiguous()
-        elif self.bitblas_matmul.config.zeros_mode == "rescale":
-            self.zeros[:, :] = intzeros.to(torch.float16)[:, :] * self.scales[:, :]
-        elif self.bitblas_matmul.config.zeros_mode == "quantized":
-            self.zeros = (
-                torch.Tensor(
-                    general_compress(intzeros.T.contiguous().cpu().numpy(), self.bits)
+        self._repack_from_gptq(gptq_module, device, unpack_qzeros)
+
+    def repack_from_gptq_v2(self, gptq_module):
+        self._repack_from_gptq(gptq_module, "cuda", unpack_qzeros_v2)
+
+    @classmethod
+    def bulk_repack_from_gptq(
+        cls, linears, gptq_modules, device="cuda", v2=False, max_layers_per_batch=32
+    ):
+        """
+        Repack every linear from the gptq module at the same position, like
+        repack_from_gptq (repack_from_gptq_v2 if `v2`). Layers whose packed weights
+        and zeros share a shape and device are unpacked together, so a full model
+        launches one unpack kernel per distinct layer shape instead of per layer.
+        The repacked weights are placed on `device`, with or without `v2`.
+
+        Each batch holds the stacked inputs and the unpacked int8 weights and zeros
+        (8 // bits times the packed size) of up to `max_layers_per_batch` layers,
+        so that bounds the extra peak memory on the gptq modules' device.
+        """
+        if len(linears) != len(gptq_modules):
+            raise ValueError("`linears` and `gptq_modules` must have the same length.")
+        if max_layers_per_batch < 1:
+            raise ValueError("`max_layers_per_batch` must be at least 1.")
+        unpack_qzeros_fn = unpack_qzeros_v2 if v2 else unpack_qzeros
+
+        groups = {}
+        for linear, gptq_module in zip(linears, gptq_modules):
+            key = (
+                linear.bits,
+                gptq_module.qweight.shape,
+                gptq_module.qzeros.shape,
+                gptq_module.qweight.device,
+                gptq_module.qzeros.device,
+            )
+            groups.setdefault(key, []).append((linear, gptq_module))
+
+        for group in groups.values():
+            for start in range(0, len(group), max_layers_per_batch):
+                cls._bulk_repack_batch(
+                    group[start : start + max_layers_per_batch],
+                    device,
+                    unpack_qzeros_fn,
                 )
-                .to(self.qweight.device)
-                .to(self.zeros.dtype)
-                .contiguous()
+
+    @classmethod
+    def _bulk_repack_batch(cls, members, device, unpack_qzeros_fn):
+        first = members[0][0]
+        qzeros = torch.stack([gptq_module.qzeros for _, gptq_module in members])
+        intzeros = unpack_qzeros_fn(
+            qzeros.view(-1, qzeros.shape[-1]),
+            first.bits,
+            first._unpack_mask,
+            first._get_unpack_shifts(qzeros.device),
+        ).view(len(members), qzeros.shape[1], -1)
+
+        intweights = {}
+        unpack_ids = [
+            i
+            for i, (linear, _) in enumerate(members)
+            if linear._needs_unpacked_weight()
+        ]
+        if unpack_ids:
+            # transposed like in _repack_from_gptq, one slab per layer.
+            qweight = torch.stack([members[i][1].qweight.T for i in unpack_ids]).view(
+                cls.TORCH_STORAGE_DTYPE
             )
-        else:
-            raise ValueError(
-                f"Unsupported zeros type: {self.bitblas_matmul.config.zeros_mode}"
+            unpacked = unpack_qweight(
+                qweight.view(-1, qweight.shape[-1]),
+                first.bits,
+                first._unpack_mask,
+                first._get_unpack_shifts(qweight.device),
+            ).view(len(unpack_ids), qweight.shape[1], -1)
+            intweights = dict(zip(unpack_ids, unpacked))
+
+        for i, (linear, gptq_module) in enumerate(members):
+            linear._repack_from_gptq(
+                gptq_module,
+                device,
+                unpack_qzeros_fn,
+                intweight=intweights.get(i),
+                intzeros=intzeros[i],
             )
-        if self.bias is not None:
-            self.bias = gptq_module.bias.data.to(torch.float16).contiguous()
 
-    def repack_from_gptq_v2(self, gptq_module):
-        # qweight in gptq old quant linear stored with (out_features, in_features), should be transposed.
-        qweight = gptq_module.qweight.T.contiguous().view(self.TORCH_STORAGE_DTYPE)
-        intweight = unpack_qweight(qweight, self.bits).contiguous()
-        if self.bitblas_matmul.weight_transform is not None:
-            qweight = self.bitblas_matmul.weight_transform(intweight.cpu()).cuda()
-        self.qweight = qweight
+    def _repack_from_gptq(
+        self, gptq_module, device, unpack_qzeros_fn, intweight=None, intzeros=None
+    ):
+        if BITBLAS_DEV_BENCHMARK_UNPACK:
+            _dev_benchmark_unpack(
+                gptq_module.qweight,
+                gptq_module.qzeros,
+                self.bits,
+                unpack_qzeros_fn,
+                unpack_weight=self._needs_unpacked_weight(),
+            )
+        if intweight is None:
+            # qweight in gptq old quant linear stored with (out_features, in_features), should be transposed.
+            qweight = gptq_module.qweight.T.contiguous().view(self.TORCH_STORAGE_DTYPE)
+            self.qweight = self._repack_qweight(qweight, device)
+        else:
+            # unpacked by bulk_repack_from_gptq from its stacked transposed copy.
+            self.qweight = self._transform_weight(intweight.contiguous(), device)
         # scales in gptq old quant linear stored with (in_features // group_size, out_features), should be transposed.
-        scales = gptq_module.scales.T.contiguous().view(self.torch_dtype)
+        scales = gptq_module.scales.T.to(self.torch_dtype).contiguous()
         self.scales = scales
         # qzeros should be dequantized to int zeros.
-        intzeros = unpack_qzeros_v2(gptq_module.qzeros, self.bits).T.contiguous()
-        if self.bitblas_matmul.config.zeros_mode == "original":
-            self.zeros = intzeros.to(torch.float16).contiguous()
-        elif self.bitblas_matmul.config.zeros_mode == "rescale":
-            self.zeros[:, :] = intzeros.to(torch.float16)[:, :] * self.scales[:, :]
-        elif self.bitblas_matmul.config.zeros_mode == "quantized":
-            self.zeros = (
-                torch.Tensor(
-                    general_compress(intzeros.T.contiguous().cpu().numpy(), self.bits)
+        qzeros = gptq_module.qzeros
+        shifts = self._get_unpack_shifts(qzeros.device)
+        zeros_mode = self.bitblas_matmul.config.zeros_mode
+        if zeros_mode not in ("original", "rescale", "quantized"):
+            raise ValueError(f"Unsupported zeros type: {zeros_mode}")
+        if zeros_mode == "quantized":
+            if intzeros is None:
+                intzeros = unpack_qzeros_fn(
+                    qzeros, self.bits, self._unpack_mask, shifts
                 )
+            self.zeros = (
+                _compress_zeros(intzeros, self.bits, self.TORCH_STORAGE_DTYPE)
                 .to(self.qweight.device)
                 .to(self.zeros.dtype)
                 .contiguous()
             )
         else:
-            raise ValueError(
-                f"Unsupported zeros type: {self.bitblas_matmul.config.zeros_mode}"
-            )
+            # every path writes into one buffer, the existing zeros when it fits.
+            if _same_layout(self.zeros, self.scales):
+                out = self.zeros
+            else:
+                out = torch.empty_like(self.scales)
+            if intzeros is None and qzeros.is_cuda:
+                self.zeros = _compiled_dequantize_zeros(
+                    qzeros,
+                    self.scales,
+                    self.bits,
+                    self._unpack_mask,
+                    shifts,
+                    zeros_mode,
+                    unpack_qzeros_fn,
+                    out,
+                )
+            else:
+                if intzeros is None:
+                    intzeros = unpack_qzeros_fn(
+                        qzeros, self.bits, self._unpack_mask, shifts
+                    )
+                self.zeros = _finalize_zeros(intzeros, self.scales, zeros_mode, out)
         if self.bias is not None:
-            self.bias = gptq_module.bias.data.to(torch.float16).contiguous()
+            self.bias = gptq_module.bias.data.to(self.torch_dtype).contiguous()
 
     @property
     def consistent(self):
         return self.is_consitent
 
 
-__all__ = ["Linear"]
+__all__ = ["Linear", "refresh_target"]
@@ -1,5 +1,7 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
+import functools
+
 import numpy as np
 import torch
 import torch.nn as nn
@@ -51,6 +53,27 @@ def gen_quant4(k, n, groupsize=-1):
     return original_w, linear, s, (w - (maxq) // 2)
 
 
+@functools.lru_cache(maxsize=None)
+def _get_general_compress_kernel():
+    # numba is an optional dependency, only import it on first use.
+    try:
+        import numba
+    except ImportError:
+        return None
+
+    @numba.njit(parallel=True, cache=True)
+    def general_compress_kernel(lowprecision_weight, source_bits, int8_weight):
+        elems_per_byte = 8 // source_bits
+        for i in numba.prange(int8_weight.shape[0]):
+            for j in range(int8_weight.shape[1]):
+                val = 0
+                for k in range(elems_per_byte):
+                    val |= lowprecision_weight[i, j * elems_per_byte + k] << (source_bits * k)
+                int8_weight[i, j] = val
+
+    return general_compress_kernel
+
+
 def general_compress(lowprecision_weight, source_bits=4, storage_dtype=np.int8):
     elems_per_byte = 8 // source_bits
     if lowprecision_weight.dtype == np.float16:
@@ -62,6 +85,11 @@ def general_compress(lowprecision_weight, source_bits=4, storage_dtype=np.int8):
         ),
         dtype=np.int8,
     )
+    kernel = _get_general_compress_kernel()
+    if kernel is not None and lowprecision_weight.ndim == 2:
+        kernel(lowprecision_weight, source_bits, int8_weight)
+        return int8_weight.view(storage_dtype)
+
     for j in range(lowprecision_weight.shape[-1] // elems_per_byte):
         for k in range(elems_per_byte):
             int8_weight[:, j] |= lowprecision_weight[:, j * elems_per_byte + k] << (source_bits * k)
@@ -176,6 +176,112 @@ def test_correctness_weight_only_dequantize():
     correctness_weight_only_dequantize(1, 1024, 1024, True, "uint2", 128, True, True, "rescale")
 
 
+def correctness_cuda_graph_capture(m, in_features, out_features):
+    linear_torch = (nn.Linear(in_features, out_features, bias=False).to(torch.float16).cuda())
+    linear_bitblas = BitBLASLinear(
+        in_features,
+        out_features,
+        bias=False,
+        A_dtype="float16",
+        W_dtype="float16",
+        accum_dtype="float16",
+        out_dtype="float16",
+        opt_M=m,
+    ).cuda()
+
+    with torch.no_grad():
+        linear_bitblas.load_and_transform_weight(linear_torch.weight.clone())
+        linear_bitblas.capture(torch.randn(m, in_features, dtype=torch.float16).cuda())
+        for _ in range(2):
+            input_data = torch.randn(m, in_features, dtype=torch.float16).cuda()
+            output_torch = linear_torch(input_data)
+            output_bitblas = linear_bitblas(input_data)
+            bitblas.testing.torch_assert_close(output_torch, output_bitblas, rtol=1e-1, atol=1e-2)
+
+
+def test_correctness_cuda_graph_capture():
+    correctness_cuda_graph_capture(1, 1024, 1024)
+
+
+def correctness_swap_params(m, in_features, out_features, group_size):
+    linear_bitblas = BitBLASLinear(
+        in_features,
+        out_features,
+        bias=False,
+        A_dtype="float16",
+        W_dtype="uint4",
+        accum_dtype="float16",
+        out_dtype="float16",
+        group_size=group_size,
+        with_scaling=True,
+        with_zeros=False,
+        opt_M=m,
+    ).cuda()
+
+    def make_params():
+        intweight = torch.randint(0, 16, (out_features, in_features), dtype=torch.int8).cuda()
+        scales = torch.rand(out_features, in_features // group_size, dtype=torch.float16).cuda()
+        ref_weight = intweight.to(torch.float16) * scales.repeat_interleave(group_size, dim=1)
+        return intweight, scales, ref_weight
+
+    def assert_forward(ref_weight):
+        input_data = torch.rand(m, in_features, dtype=torch.float16).cuda() - 0.5
+        output_bitblas = linear_bitblas(input_data)
+        bitblas.testing.torch_assert_close(
+            output_bitblas, torch.matmul(input_data, ref_weight.T), rtol=1e-1, atol=1e-1)
+
+    with torch.no_grad():
+        intweight, scales, ref_weight = make_params()
+        linear_bitblas.load_and_transform_weight(intweight, scales=scales)
+        assert_forward(ref_weight)
+        # the cached kernel pointers must follow a reassigned buffer ...
+        intweight, scales, ref_weight = make_params()
+        linear_bitblas.qweight = linear_bitblas.bitblas_matmul.transform_weight(intweight)
+        linear_bitblas.scales = scales.clone()
+        assert_forward(ref_weight)
+        # ... and a buffer whose storage is swapped through `.data`.
+        intweight, scales, ref_weight = make_params()
+        linear_bitblas.qweight.data = linear_bitblas.bitblas_matmul.transform_weight(intweight)
+        linear_bitblas.scales.data = scales.clone()
+        assert_forward(ref_weight)
+
+
+def test_correctness_swap_params():
+    correctness_swap_params(1, 1024, 1024, 128)
+
+
+def correctness_reload_weight(m, in_features, out_features):
+    linear_torch = (nn.Linear(in_features, out_features, bias=True).to(torch.float16).cuda())
+    linear_bitblas = BitBLASLinear(
+        in_features,
+        out_features,
+        bias=True,
+        A_dtype="float16",
+        W_dtype="float16",
+        accum_dtype="float16",
+        out_dtype="float16",
+        opt_M=m,
+    ).cuda()
+
+    with torch.no_grad():
+        # the second load moves the weight to another device, which replaces
+        # the parameters instead of copying into them; the third moves them back.
+        for device in ["cuda", "cpu", "cuda"]:
+            linear_bitblas.load_and_transform_weight(
+                linear_torch.weight.clone().to(device), bias=linear_torch.bias.clone().to(device))
+            assert isinstance(linear_bitblas.weight, nn.Parameter)
+            assert linear_bitblas.weight.device.type == device
+            assert linear_bitblas.bias.device.type == device
+        input_data = torch.randn(m, in_features, dtype=torch.float16).cuda()
+        output_torch = linear_torch(input_data)
+        output_bitblas = linear_bitblas(input_data)
+    bitblas.testing.torch_assert_close(output_torch, output_bitblas, rtol=1e-1, atol=1e-2)
+
+
+def test_correctness_reload_weight():
+    correctness_reload_weight(1, 1024, 1024)
+
+
 def profile(model, input_data):
     model = model.cuda()
     model.eval()
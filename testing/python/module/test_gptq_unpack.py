@@ -0,0 +1,80 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+import bitblas
+import bitblas.testing
+from bitblas.module import unpack_qweight, unpack_qzeros, unpack_qzeros_v2
+import torch
+
+torch.manual_seed(0)
+
+
+# reference per-column loops the vectorized unpack functions replaced
+def unpack_qzeros_ref(qzeros, bits, add_one):
+    qzeros = qzeros.view(torch.int32)
+    elems_per_int32 = 32 // bits
+    unpacked_zeros = torch.zeros((qzeros.shape[0], qzeros.shape[1] * elems_per_int32),
+                                 dtype=torch.int8)
+    for col in range(unpacked_zeros.shape[1]):
+        i = col % elems_per_int32
+        unpacked_zeros[:, col] = qzeros[:, col // elems_per_int32] >> (bits * i)
+    if add_one:
+        unpacked_zeros = unpacked_zeros + 1
+    return torch.bitwise_and(unpacked_zeros, 2**bits - 1)
+
+
+def unpack_qweight_ref(qweight, bits):
+    qweight = qweight.view(torch.int8)
+    elems_per_int8 = 8 // bits
+    unpacked_weight = torch.zeros((qweight.shape[0], qweight.shape[1] * elems_per_int8),
+                                  dtype=torch.int8)
+    for col in range(unpacked_weight.shape[1]):
+        i = col % elems_per_int8
+        unpacked_weight[:, col] = qweight[:, col // elems_per_int8] >> (bits * i)
+    return torch.bitwise_and(unpacked_weight, 2**bits - 1)
+
+
+def random_int32(rows, cols):
+    return torch.randint(-2**31, 2**31 - 1, (rows, cols), dtype=torch.int32)
+
+
+def assert_unpack_qzeros(rows, cols, bits):
+    qzeros = random_int32(rows, cols)
+    torch.testing.assert_close(unpack_qzeros(qzeros, bits), unpack_qzeros_ref(qzeros, bits, True))
+    torch.testing.assert_close(
+        unpack_qzeros_v2(qzeros, bits), unpack_qzeros_ref(qzeros, bits, False))
+
+
+def assert_unpack_qweight(rows, cols, bits):
+    # gptq qweight is transposed and viewed as int8 before unpacking
+    qweight = random_int32(cols, rows).T.contiguous().view(torch.int8)
+    torch.testing.assert_close(unpack_qweight(qweight, bits), unpack_qweight_ref(qweight, bits))
+
+
+def test_unpack_qzeros():
+    for bits in [2, 4, 8]:
+        assert_unpack_qzeros(8, 16, bits)
+
+
+def test_unpack_qweight():
+    for bits in [2, 4, 8]:
+        assert_unpack_qweight(64, 16, bits)
+
+
+def test_unpack_qweight_int32_view():
+    # rows whose byte count is a multiple of 4 are unpacked from int32 words, which
+    # relies on little-endian byte order; other widths fall back to int8 bytes.
+    for bits in [1, 2, 4, 8]:
+        for num_bytes in [8, 6]:
+            qweight = torch.randint(-128, 127, (32, num_bytes), dtype=torch.int8)
+            torch.testing.assert_close(
+                unpack_qweight(qweight, bits), unpack_qweight_ref(qweight, bits))
+        # views whose row stride or offset is not a multiple of 4 bytes cannot be
+        # reinterpreted as int32 words and must take the byte path too.
+        storage = torch.randint(-128, 127, (8, 10), dtype=torch.int8)
+        for qweight in [storage[:, :8], storage.view(-1)[2:66].view(8, 8)]:
+            torch.testing.assert_close(
+                unpack_qweight(qweight, bits), unpack_qweight_ref(qweight, bits))
+
+
+if __name__ == "__main__":
+    bitblas.testing.main()
@@ -0,0 +1,35 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+import bitblas
+import bitblas.testing
+import bitblas.module
+
+
+def test_refresh_target(monkeypatch):
+    detected = []
+
+    def fake_auto_detect_nvidia_target(gpu_id=0):
+        detected.append(gpu_id)
+        return f"target-{len(detected)}"
+
+    monkeypatch.setattr(bitblas.module, "auto_detect_nvidia_target", fake_auto_detect_nvidia_target)
+    monkeypatch.delenv("CUDA_VISIBLE_DEVICES", raising=False)
+    bitblas.module._cached_target.cache_clear()
+    try:
+        assert bitblas.module._cached_target(0) == "target-1"
+        # memoized per gpu
+        assert bitblas.module._cached_target(0) == "target-1"
+        assert bitblas.module._cached_target(1) == "target-2"
+        # refresh clears the cache and detects again
+        assert bitblas.module.refresh_target(0) == "target-3"
+        assert bitblas.module._cached_target(1) == "target-4"
+        # nvidia-smi indices ignore CUDA_VISIBLE_DEVICES
+        monkeypatch.setenv("CUDA_VISIBLE_DEVICES", "2,3")
+        assert bitblas.module.refresh_target(1) == "target-5"
+        assert detected == [0, 1, 0, 1, 3]
+    finally:
+        bitblas.module._cached_target.cache_clear()
+
+
+if __name__ == "__main__":
+    bitblas.testing.main()
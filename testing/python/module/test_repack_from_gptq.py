@@ -8,7 +8,12 @@ torch.manual_seed(0)
 bitblas.set_log_level("DEBUG")
 
 
-def assert_output_with_gptq(m, in_features, out_features, group_size):
+def make_gptq_and_bitblas_linear(m,
+                                 in_features,
+                                 out_features,
+                                 group_size,
+                                 zeros_mode="quantized",
+                                 propagate_b=False):
     from auto_gptq.nn_modules.qlinear.qlinear_cuda_old import (
         QuantLinear as CudaOldQuantLinear,)
 
@@ -16,7 +21,9 @@ def assert_output_with_gptq(m, in_features, out_features, group_size):
         group_size = in_features
     _, linear, s, _ = bitblas.quantization.gen_quant4(in_features, out_features, group_size)
 
-    zeros = torch.full((in_features // group_size, out_features), 7, dtype=torch.int32)
+    # random per layer, so that a layer picking up another layer's zeros fails.
+    # pack() stores zeros - 1, so keep them above 0 to stay within the 4 bits.
+    zeros = torch.randint(1, 2**4 - 1, (in_features // group_size, out_features), dtype=torch.int32)
 
     cuda_old_linear = CudaOldQuantLinear(
         bits=4,
@@ -41,11 +48,13 @@ def assert_output_with_gptq(m, in_features, out_features, group_size):
         group_size=group_size,  # setting for grouped quantization
         with_scaling=True,  # setting for scaling factor
         with_zeros=True,  # setting for zeros
-        zeros_mode="quantized",  # setting for how to calculating zeros
+        zeros_mode=zeros_mode,  # setting for how to calculating zeros
+        propagate_b=propagate_b,
     )
-    # Repack weights from CudaOldQuantLinear to BitBLAS linear module
-    bitblas_linear.repack_from_gptq(cuda_old_linear)
+    return cuda_old_linear, bitblas_linear
+
 
+def assert_close_with_gptq(m, in_features, cuda_old_linear, bitblas_linear):
     # Prepare input data
     inp = torch.rand(m, in_features, dtype=torch.float16, device="cuda")
 
@@ -62,10 +71,60 @@ def assert_output_with_gptq(m, in_features, out_features, group_size):
     torch.testing.assert_close(res_bitblas, res_cuda_old, rtol=1e-0, atol=1e-1)
 
 
+def assert_output_with_gptq(m,
+                            in_features,
+                            out_features,
+                            group_size,
+                            zeros_mode="quantized",
+                            gptq_device="cpu"):
+    cuda_old_linear, bitblas_linear = make_gptq_and_bitblas_linear(m, in_features, out_features,
+                                                                   group_size, zeros_mode)
+    cuda_old_linear = cuda_old_linear.to(gptq_device)
+    # Repack weights from CudaOldQuantLinear to BitBLAS linear module
+    bitblas_linear.repack_from_gptq(cuda_old_linear)
+    assert_close_with_gptq(m, in_features, cuda_old_linear, bitblas_linear)
+
+
 @bitblas.testing.requires_package("auto_gptq")
 def test_assert_output_with_gptq():
     assert_output_with_gptq(1, 256, 256, 64)
     assert_output_with_gptq(1, 256, 256, -1)
+    # cuda qzeros in original/rescale mode take the torch.compile'd dequantization
+    assert_output_with_gptq(1, 256, 256, 64, zeros_mode="original", gptq_device="cuda")
+    assert_output_with_gptq(1, 256, 256, 64, zeros_mode="rescale", gptq_device="cuda")
+
+
+def assert_bulk_repack_with_gptq(m,
+                                 in_features,
+                                 out_features,
+                                 group_size,
+                                 num_layers,
+                                 zeros_mode="quantized",
+                                 propagate_b=False,
+                                 max_layers_per_batch=32):
+    cuda_old_linears, bitblas_linears = [], []
+    for _ in range(num_layers):
+        cuda_old_linear, bitblas_linear = make_gptq_and_bitblas_linear(
+            m, in_features, out_features, group_size, zeros_mode, propagate_b)
+        # unpack on the device, as when repacking a model that is already loaded
+        cuda_old_linears.append(cuda_old_linear.to("cuda"))
+        bitblas_linears.append(bitblas_linear)
+
+    bitblas.Linear.bulk_repack_from_gptq(
+        bitblas_linears, cuda_old_linears, max_layers_per_batch=max_layers_per_batch)
+
+    for cuda_old_linear, bitblas_linear in zip(cuda_old_linears, bitblas_linears):
+        assert_close_with_gptq(m, in_features, cuda_old_linear, bitblas_linear)
+
+
+@bitblas.testing.requires_package("auto_gptq")
+def test_bulk_repack_with_gptq():
+    assert_bulk_repack_with_gptq(1, 256, 256, 64, 3)
+    assert_bulk_repack_with_gptq(1, 256, 256, 64, 3, max_layers_per_batch=2)
+    assert_bulk_repack_with_gptq(1, 256, 256, 64, 3, zeros_mode="original")
+    assert_bulk_repack_with_gptq(1, 256, 256, 64, 3, zeros_mode="rescale")
+    # propagate_b layers take the batched unpack_qweight path
+    assert_bulk_repack_with_gptq(16, 256, 256, 64, 3, propagate_b=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+import bitblas
+import bitblas.testing
+from bitblas.module import _pack_low_bits
+from bitblas.quantization.utils import general_compress
+import numpy as np
+import torch
+
+np.random.seed(0)
+
+
+def assert_pack_low_bits_with_general_compress(rows, cols, bits):
+    lowprecision_weight = np.random.randint(0, 2**bits, (rows, cols)).astype(np.int8)
+    ref = torch.from_numpy(general_compress(lowprecision_weight, bits))
+    packed = _pack_low_bits(torch.from_numpy(lowprecision_weight), bits)
+    assert packed.dtype == torch.int8
+    torch.testing.assert_close(packed, ref)
+
+
+def test_pack_low_bits_with_general_compress():
+    for bits in [1, 2, 4]:
+        assert_pack_low_bits_with_general_compress(16, 64, bits)
+
+
+# reference NumPy loop the numba kernel replaced
+def general_compress_ref(lowprecision_weight, source_bits):
+    elems_per_byte = 8 // source_bits
+    int8_weight = np.zeros(
+        (*lowprecision_weight.shape[:-1], lowprecision_weight.shape[-1] // elems_per_byte),
+        dtype=np.int8,
+    )
+    for j in range(lowprecision_weight.shape[-1] // elems_per_byte):
+        for k in range(elems_per_byte):
+            int8_weight[:, j] |= lowprecision_weight[:, j * elems_per_byte + k] << (source_bits * k)
+    return int8_weight
+
+
+def assert_general_compress_with_ref(rows, cols, bits, signed):
+    low = -(2**(bits - 1)) if signed else 0
+    lowprecision_weight = np.random.randint(low, low + 2**bits, (rows, cols)).astype(np.int8)
+    np.testing.assert_array_equal(
+        general_compress(lowprecision_weight, bits),
+        general_compress_ref(lowprecision_weight, bits))
+
+
+@bitblas.testing.requires_package("numba")
+def test_general_compress_numba_with_ref():
+    for bits in [2, 4]:
+        for signed in [False, True]:
+            assert_general_compress_with_ref(16, 64, bits, signed)
+
+
+if __name__ == "__main__":
+    bitblas.testing.main()